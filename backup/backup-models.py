@@ -12,13 +12,28 @@
 # What it does:
 #   - Creates a .tar.zst archive with root 'tabbyclassmodels/' under HOME
 #   - Includes only 'tabbyclassmodels/models' subtree
-#   - Generates a SHA256 checksum file (.sha256)
-#   - Uploads both to s3://<bucket>/model-backups/
+#   - Generates a SHA256 checksum file (.sha256) while compressing
+#   - Skips the upload if the latest S3 backup has the same SHA256
+#   - Otherwise uploads both to s3://<bucket>/model-backups/
+#   - With --stream, uploads while the archive is still being created
 #   - Optionally deletes local archive via --cleanup
 # ==========================================================
-import os, argparse, datetime, sys, subprocess
+import os, argparse, datetime, sys
 sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
-from include.s3_utils import *
+from include.s3_utils import (
+    DEFAULT_BUCKET,
+    DEFAULT_ENDPOINT,
+    DEFAULT_PROFILE,
+    ZSTD_MODELS_LEVEL,
+    StreamingUpload,
+    create_archive_from_home,
+    find_latest_backup,
+    get_s3_client,
+    log,
+    remote_sha256,
+    upload_files,
+    upload_if_changed,
+)
 
 def main():
     parser = argparse.ArgumentParser(description="Backup Tabby models → Hetzner S3")
@@ -26,6 +41,10 @@ def main():
     parser.add_argument("--endpoint", default=DEFAULT_ENDPOINT, help="S3 endpoint URL")
     parser.add_argument("--profile", default=DEFAULT_PROFILE, help="AWS profile name")
     parser.add_argument("--cleanup", action="store_true", help="Remove local archive after successful upload")
+    parser.add_argument("--stream", action="store_true",
+                        help="Upload while the archive is being created (no unchanged-archive check)")
+    parser.add_argument("--zstd-level", type=int, default=ZSTD_MODELS_LEVEL,
+                        help="zstd compression level (negative = --fast=N)")
     args = parser.parse_args()
 
     date = datetime.date.today().isoformat()
@@ -33,23 +52,29 @@ def main():
     checksum_file = f"{archive}.sha256"
     prefix = "model-backups/"
 
+    s3 = get_s3_client(args.profile, args.endpoint)
+    stream = StreamingUpload(s3, args.bucket, prefix + archive) if args.stream else None
+
     log("📦 Creating archive with root '~/tabbyclassmodels' (models/ only) ...")
-    ensure_system_tar_zstd()
-    home = os.path.expanduser("~")
     # Archive 'tabbyclassmodels/models' so archive contains the leading folder
-    cmd = ["tar", "-I", "zstd -T0 -19", "-cvhf", archive, "-C", home, "tabbyclassmodels/models"]
-    subprocess.run(cmd, check=True)
+    checksum = create_archive_from_home(archive, ["tabbyclassmodels/models"], stream=stream,
+                                        level=args.zstd_level)
 
-    log("🔢 Calculating checksum ...")
-    checksum = calculate_sha256(archive)
     with open(checksum_file, "w") as f:
         f.write(f"{checksum}  {archive}\n")
 
-    s3 = get_s3_client(args.profile, args.endpoint)
-
-    log("☁️ Uploading to S3 ...")
-    upload_file(s3, args.bucket, prefix + archive, archive)
-    upload_file(s3, args.bucket, prefix + checksum_file, checksum_file)
+    if stream:
+        upload_if_changed(s3, args.bucket, prefix + checksum_file, checksum_file)
+    else:
+        latest = find_latest_backup(s3, args.bucket, prefix, stem="models")
+        if latest and remote_sha256(s3, args.bucket, latest) == checksum:
+            log(f"✅ Archive unchanged since {latest} — skipping upload.")
+        else:
+            log("☁️ Uploading to S3 ...")
+            upload_files(s3, args.bucket, [
+                (prefix + archive, archive, checksum),
+                (prefix + checksum_file, checksum_file, None),
+            ])
 
     log("✅ Backup complete!")
     if args.cleanup:
@@ -3,7 +3,8 @@
 # 🔧  Shared S3 + Archiving Utilities for Tabby Backups
 # ==========================================================
 # Provides:
-#   - S3 client setup for Hetzner Object Storage (via boto3 Session profile)
+#   - S3 client setup for Hetzner Object Storage (via boto3 Session profile,
+#     imported lazily)
 #   - Upload/Download helpers (simple logs, no external deps)
 #   - .tar.zst create/extract using *system* tar+zstd only
 #   - SHA256 checksum generation & verification
@@ -15,18 +16,36 @@
 #
 # NOTE: Requires system binaries: tar, zstd, unzstd
 # ==========================================================
-import os, sys, hashlib, subprocess, shutil
+import os, sys, hashlib, subprocess, shutil, datetime, threading, functools
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional
-import boto3, botocore
+
+# boto3/botocore are imported inside the S3 helpers: they take ~300 ms
+# to load, and `--help` or the archive/hash helpers never need them.
 
 DEFAULT_ENDPOINT = "https://fsn1.your-objectstorage.com"
 DEFAULT_BUCKET   = "tabby-models"
 DEFAULT_REGION   = "fsn1"
 DEFAULT_PROFILE  = "hetzner"
 
+HASH_BUFFER_SIZE = 4 * 1024 * 1024
+
+# Level 19 costs several times the CPU of 10 for well under 1% smaller
+# archives; the 128 MiB long-distance window catches cross-file repeats.
+# Model weights are already dense and barely compress, so they get a
+# negative ("--fast") level instead.
+ZSTD_LEVEL        = int(os.getenv("ZSTD_LEVEL", "10"))
+ZSTD_MODELS_LEVEL = int(os.getenv("ZSTD_MODELS_LEVEL", "-3"))
+ZSTD_WINDOW_LOG   = 27
+
+MULTIPART_CHUNKSIZE = 64 * 1024 * 1024
+MAX_COPY_SIZE       = 5 * 1024 ** 3  # CopyObject limit for a single request
+DOWNLOAD_CHUNKSIZE  = 8 * 1024 * 1024
+
 def log(msg: str) -> None:
     print(msg, flush=True)
 
+@functools.lru_cache(maxsize=None)  # a failed check raises, so only success is cached
 def ensure_system_tar_zstd() -> None:
     missing = []
     if not shutil.which("tar"):
@@ -39,50 +58,353 @@ def ensure_system_tar_zstd() -> None:
         raise RuntimeError(f"Missing required system tools: {', '.join(missing)}. Please install them.")
 
 def calculate_sha256(filepath: str) -> str:
-    h = hashlib.sha256()
-    with open(filepath, "rb") as f:
-        for chunk in iter(lambda: f.read(1024 * 1024), b""):
-            h.update(chunk)
-    return h.hexdigest()
+    with open(filepath, "rb", buffering=0) as f:
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        return hashlib.file_digest(f, "sha256").hexdigest()
 
 def verify_sha256(filepath: str, checksum: str) -> bool:
     return calculate_sha256(filepath) == checksum
 
-def create_archive_from_home_include_tabbyclassmodels(archive_path: str, include_models: bool) -> None:
+class StreamingUpload:
+    """
+    S3 multipart upload fed incrementally via write().
+
+    Full parts are handed to a thread pool as soon as they accumulate, so
+    the upload runs while the archive is still being produced. At most
+    2 * max_workers parts are held in memory at once.
+    """
+
+    def __init__(self, s3, bucket: str, key: str,
+                 part_size: int = MULTIPART_CHUNKSIZE,
+                 max_workers: int = 8):
+        self.s3, self.bucket, self.key = s3, bucket, key
+        self.part_size = part_size
+        self.upload_id = s3.create_multipart_upload(Bucket=bucket, Key=key)["UploadId"]
+        self._pool = ThreadPoolExecutor(max_workers=max_workers)
+        self._slots = threading.BoundedSemaphore(2 * max_workers)
+        self._buf = bytearray()
+        self._futures = []
+        self.size = 0
+        self._completed = False
+
+    def write(self, data) -> None:
+        self._buf += data
+        self.size += len(data)
+        while len(self._buf) >= self.part_size:
+            self._submit(bytes(self._buf[:self.part_size]))
+            del self._buf[:self.part_size]
+
+    def _submit(self, body: bytes) -> None:
+        self._slots.acquire()
+        part_number = len(self._futures) + 1
+        self._futures.append(self._pool.submit(self._upload_part, part_number, body))
+
+    def _upload_part(self, part_number: int, body: bytes) -> dict:
+        try:
+            resp = self.s3.upload_part(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                                       PartNumber=part_number, Body=body)
+            return {"PartNumber": part_number, "ETag": resp["ETag"]}
+        finally:
+            self._slots.release()
+
+    def complete(self, sha256: Optional[str] = None) -> None:
+        """
+        Finish the upload. The digest is only known now, after the multipart
+        upload was created, so it is attached with a server-side self-copy;
+        above the CopyObject size limit, or if that copy fails,
+        remote_sha256() falls back to the .sha256 sidecar instead.
+        """
+        try:
+            if self._buf or not self._futures:
+                self._submit(bytes(self._buf))  # last part may be smaller than part_size
+                self._buf.clear()
+            parts = [f.result() for f in self._futures]
+            self._pool.shutdown()
+            self.s3.complete_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                                              MultipartUpload={"Parts": parts})
+        except BaseException:
+            self.abort()
+            raise
+        self._completed = True
+        log(f"✅ Uploaded s3://{self.bucket}/{self.key} ({len(parts)} parts)")
+        if sha256 and self.size <= MAX_COPY_SIZE:
+            try:
+                self.s3.copy_object(Bucket=self.bucket, Key=self.key,
+                                    CopySource={"Bucket": self.bucket, "Key": self.key},
+                                    Metadata={"sha256": sha256}, MetadataDirective="REPLACE")
+            except Exception as e:
+                log(f"⚠️ Could not tag s3://{self.bucket}/{self.key} with its sha256 ({e}); "
+                    "the .sha256 sidecar stands in.")
+
+    def abort(self) -> None:
+        if self._completed:
+            return  # nothing left to abort; the object is in place
+        self._pool.shutdown(cancel_futures=True)
+        self.s3.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+        log(f"⚠️ Aborted upload of s3://{self.bucket}/{self.key}")
+
+def zstd_level_arg(level: int) -> str:
+    """zstd CLI flag for `level`; negative levels map to --fast=N."""
+    return f"--fast={-level}" if level < 0 else f"-{level}"
+
+def create_archive_from_home(archive_path: str, members: list, excludes: tuple = (),
+                             stream: Optional[StreamingUpload] = None,
+                             level: int = ZSTD_LEVEL) -> str:
+    """
+    Stream `tar | zstd` for `members` (relative to HOME) into archive_path.
+
+    The compressed bytes are hashed while being written, so the archive
+    never has to be read back. If `stream` is given, the same bytes are
+    uploaded to S3 concurrently. Returns the SHA256 hex digest of the archive.
+    """
     ensure_system_tar_zstd()
     home = os.path.expanduser("~")
+    tar_cmd = ["tar", "-cvhf", "-", "-C", home]
+    for pattern in excludes:
+        tar_cmd += ["--exclude", pattern]
+    tar_cmd += list(members)
+
+    tar = subprocess.Popen(tar_cmd, stdout=subprocess.PIPE)
+    zstd = subprocess.Popen(
+        ["zstd", "-T0", zstd_level_arg(level), f"--long={ZSTD_WINDOW_LOG}", "-c"],
+        stdin=tar.stdout, stdout=subprocess.PIPE)
+    tar.stdout.close()  # zstd owns the read end now
+
+    h = hashlib.sha256()
+    buf = bytearray(HASH_BUFFER_SIZE)
+    view = memoryview(buf)
+    try:
+        with open(archive_path, "wb") as out:
+            while n := zstd.stdout.readinto(buf):
+                h.update(view[:n])
+                out.write(view[:n])
+                if stream:
+                    stream.write(view[:n])
+        zstd.stdout.close()
+
+        if tar.wait() != 0:
+            raise subprocess.CalledProcessError(tar.returncode, tar_cmd)
+        if zstd.wait() != 0:
+            raise subprocess.CalledProcessError(zstd.returncode, zstd.args)
+    except BaseException:
+        # Write error, failed tool or Ctrl-C: reap both tools and drop the
+        # truncated archive so no later run uploads or verifies it.
+        for proc in (tar, zstd):
+            proc.kill()
+        for proc in (tar, zstd):
+            proc.wait()
+        zstd.stdout.close()
+        try:
+            os.unlink(archive_path)
+        except FileNotFoundError:
+            pass
+        if stream:
+            stream.abort()
+        raise
+
+    # The archive is complete on disk; a failure from here on (complete()
+    # aborts its own multipart upload) must not delete it.
+    if stream:
+        stream.complete(sha256=h.hexdigest())
+    return h.hexdigest()
+
+def create_archive_from_home_include_tabbyclassmodels(archive_path: str, include_models: bool,
+                                                      stream: Optional[StreamingUpload] = None,
+                                                      level: int = ZSTD_LEVEL) -> str:
     src_root = "tabbyclassmodels"
-    cmd = ["tar", "-I", "zstd -T0 -19", "-cvhf", archive_path, "-C", home]
-    if not include_models:
-        cmd += ["--exclude", f"{src_root}/models"]
-    cmd += [src_root]
-    subprocess.run(cmd, check=True)
+    excludes = () if include_models else (f"{src_root}/models",)
+    return create_archive_from_home(archive_path, [src_root], excludes, stream, level)
 
 def extract_archive_to_home(archive_path: str) -> None:
     ensure_system_tar_zstd()
     home = os.path.expanduser("~")
-    subprocess.run(["tar", "--use-compress-program=unzstd", "-xvf", archive_path, "-C", home], check=True)
+    subprocess.run(["tar", f"--use-compress-program=unzstd --long={ZSTD_WINDOW_LOG}", "-xvf", archive_path, "-C", home], check=True)
 
+@functools.lru_cache(maxsize=None)
 def get_s3_client(profile: str = DEFAULT_PROFILE,
                   endpoint: str = DEFAULT_ENDPOINT,
                   region: str = DEFAULT_REGION):
+    """Return one shared client per (profile, endpoint, region); boto3 clients are thread-safe."""
+    import boto3
+    from botocore.config import Config
+
+    # Long uploads: keep idle TCP alive, retry individual requests adaptively,
+    # and size the pool above all concurrent transfer workers.
+    config = Config(
+        retries={"max_attempts": 10, "mode": "adaptive"},
+        tcp_keepalive=True,
+        max_pool_connections=64,
+        connect_timeout=10,
+        read_timeout=120,
+    )
     session = boto3.Session(profile_name=profile)
-    return session.client("s3", endpoint_url=endpoint, region_name=region)
+    return session.client("s3", endpoint_url=endpoint, region_name=region, config=config)
+
+@functools.lru_cache(maxsize=None)
+def get_transfer_config():
+    """Multi-GB archives: fewer, larger parts uploaded concurrently."""
+    from boto3.s3.transfer import TransferConfig
+
+    return TransferConfig(
+        multipart_threshold=MULTIPART_CHUNKSIZE,
+        multipart_chunksize=MULTIPART_CHUNKSIZE,
+        max_concurrency=16,
+        io_chunksize=1024 * 1024,
+        use_threads=True,
+    )
+
+@functools.lru_cache(maxsize=None)
+def get_download_config():
+    """
+    Ranged GETs for restores: many connections, smaller parts.
+
+    download_file writes in order, so parts that arrive early are buffered
+    in memory; 8 MiB parts keep that to ~128 MiB at 16 connections.
+    """
+    from boto3.s3.transfer import TransferConfig
+
+    return TransferConfig(
+        multipart_threshold=DOWNLOAD_CHUNKSIZE,
+        multipart_chunksize=DOWNLOAD_CHUNKSIZE,
+        max_concurrency=16,
+        io_chunksize=1024 * 1024,
+        use_threads=True,
+    )
 
-def upload_file(s3, bucket: str, key: str, local_path: str) -> None:
-    s3.upload_file(local_path, bucket, key)
+def upload_file(s3, bucket: str, key: str, local_path: str, sha256: Optional[str] = None) -> None:
+    extra_args = {"Metadata": {"sha256": sha256}} if sha256 else None
+    s3.upload_file(local_path, bucket, key, ExtraArgs=extra_args, Config=get_transfer_config())
     log(f"✅ Uploaded s3://{bucket}/{key}")
 
-def download_file(s3, bucket: str, key: str, local_path: str) -> None:
-    s3.download_file(bucket, key, local_path)
-    log(f"✅ Downloaded s3://{bucket}/{key}")
+def upload_if_changed(s3, bucket: str, key: str, local_path: str, sha256: Optional[str] = None) -> bool:
+    """
+    Upload unless s3://bucket/key already carries the same sha256 metadata.
+
+    Costs one HeadObject; returns True if the file was uploaded.
+    """
+    sha256 = sha256 or calculate_sha256(local_path)
+    if remote_sha256(s3, bucket, key) == sha256:
+        log(f"✅ Unchanged, skipped s3://{bucket}/{key}")
+        return False
+    upload_file(s3, bucket, key, local_path, sha256=sha256)
+    return True
+
+def upload_files(s3, bucket: str, files: list) -> None:
+    """Upload [(key, local_path, sha256_or_None), ...] concurrently over one client."""
+    with ThreadPoolExecutor(max_workers=len(files)) as pool:
+        futures = [pool.submit(upload_if_changed, s3, bucket, key, path, sha256)
+                   for key, path, sha256 in files]
+        for f in futures:
+            f.result()
+
+def remote_sha256(s3, bucket: str, key: str) -> Optional[str]:
+    """
+    Return the sha256 stored in the object's metadata by upload_file, if any.
+
+    Archives streamed up too large to re-tag (see StreamingUpload.complete)
+    carry none; their "<key>.sha256" sidecar is read instead.
+    """
+    from botocore.exceptions import ClientError
+
+    try:
+        head = s3.head_object(Bucket=bucket, Key=key)
+    except ClientError:
+        return None
+    sha256 = head.get("Metadata", {}).get("sha256")
+    if sha256 or key.endswith(".sha256"):
+        return sha256
+    try:
+        body = s3.get_object(Bucket=bucket, Key=key + ".sha256")["Body"].read()
+    except ClientError:
+        return None
+    return body.decode().split()[0] if body.strip() else None
+
+class _HashingWriter:
+    """
+    Write-only file wrapper that hashes bytes on their way to disk.
+
+    Having no seek() makes s3transfer hand over the concurrently fetched
+    parts strictly in order, which a running SHA256 requires.
+    """
+
+    def __init__(self, f):
+        self._f = f
+        self.sha256 = hashlib.sha256()
+
+    def write(self, data) -> int:
+        self.sha256.update(data)
+        return self._f.write(data)
+
+def download_file(s3, bucket: str, key: str, local_path: str, callback=None) -> str:
+    """
+    Download s3://bucket/key to local_path; returns the SHA256 of the downloaded bytes.
+
+    `callback(n_bytes)` is called from the transfer threads as data arrives;
+    callers passing one report progress and completion themselves.
+    """
+    with open(local_path, "wb") as f:
+        out = _HashingWriter(f)
+        s3.download_fileobj(bucket, key, out, Config=get_download_config(), Callback=callback)
+    if callback is None:
+        log(f"✅ Downloaded s3://{bucket}/{key}")
+    return out.sha256.hexdigest()
+
+def stream_extract_to_home(s3, bucket: str, key: str) -> str:
+    """
+    Pipe s3://bucket/key straight through `zstd -d | tar -x` into HOME.
+
+    Nothing but the extracted files touches the disk. The compressed bytes
+    are hashed on their way into zstd, so the returned SHA256 can only be
+    checked *after* extraction.
+    """
+    ensure_system_tar_zstd()
+    home = os.path.expanduser("~")
+    zstd = subprocess.Popen(["zstd", "-d", f"--long={ZSTD_WINDOW_LOG}", "-c"],
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE, bufsize=0)
+    tar_cmd = ["tar", "-xvf", "-", "-C", home]
+    tar = subprocess.Popen(tar_cmd, stdin=zstd.stdout)
+    zstd.stdout.close()  # tar owns the read end now
+
+    out = _HashingWriter(zstd.stdin)
+    try:
+        s3.download_fileobj(bucket, key, out, Config=get_download_config())
+        zstd.stdin.close()
+    except BrokenPipeError:
+        pass  # zstd exited early; its return code says why
+    except BaseException:
+        zstd.kill()
+        tar.kill()
+        raise
+    if zstd.wait() != 0:
+        raise subprocess.CalledProcessError(zstd.returncode, zstd.args)
+    if tar.wait() != 0:
+        raise subprocess.CalledProcessError(tar.returncode, tar_cmd)
+    log(f"✅ Streamed s3://{bucket}/{key} into {home}")
+    return out.sha256.hexdigest()
+
+def find_latest_backup(s3, bucket: str, prefix: str,
+                       stem: Optional[str] = None,
+                       window_days: int = 31) -> Optional[str]:
+    """
+    Return the newest *.tar.zst key under prefix.
 
-def find_latest_backup(s3, bucket: str, prefix: str) -> Optional[str]:
+    Backup keys embed an ISO date (e.g. db-backups/db_2025-10-26.tar.zst).
+    If `stem` ("db", "models") is given, listing starts at the key dated
+    `window_days` ago, so only recent pages are fetched. Falls back to a
+    full scan when nothing recent is found.
+    """
     paginator = s3.get_paginator("list_objects_v2")
-    latest = None
-    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
-        for obj in page.get("Contents", []):
-            if obj["Key"].endswith(".tar.zst"):
-                if latest is None or obj["LastModified"] > latest["LastModified"]:
-                    latest = obj
-    return latest["Key"] if latest else None
+    kwargs = {"Bucket": bucket, "Prefix": prefix}
+    if stem:
+        since = (datetime.date.today() - datetime.timedelta(days=window_days)).isoformat()
+        kwargs["StartAfter"] = f"{prefix}{stem}_{since}"
+    # ISO dates sort lexicographically, so the greatest key is the newest backup
+    latest = max((obj["Key"]
+                  for page in paginator.paginate(**kwargs)
+                  for obj in page.get("Contents", [])
+                  if obj["Key"].endswith(".tar.zst")),
+                 default=None)
+    if latest is None and stem:
+        return find_latest_backup(s3, bucket, prefix)
+    return latest
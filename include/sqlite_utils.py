@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# ==========================================================
+# 🗄️  Shared SQLite Helpers for the Tabby Setup Scripts
+# ==========================================================
+# Provides:
+#   - open_db(): connection to Tabby's ee/db.sqlite tuned for
+#     short bulk-write sessions while Tabby itself is stopped
+#   - shared_db(): one autocommit connection per database file,
+#     reused by every step of an in-process run_all
+#   - close_shared_db(): PRAGMA optimize + close once the last
+#     step that writes the database is done
+#
+# Tabby (sqlx) runs the database in WAL mode as well, so switching
+# the journal mode here does not change what the server expects.
+# ==========================================================
+import atexit
+import sqlite3
+from pathlib import Path
+
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL;"
+    "PRAGMA synchronous=NORMAL;"   # fsync at checkpoints, not on every commit
+    "PRAGMA temp_store=MEMORY;"
+    "PRAGMA cache_size=-65536;"    # 64 MiB page cache
+)
+
+def open_db(path: Path, isolation_level: str | None = "", check_same_thread: bool = True) -> sqlite3.Connection:
+    """
+    Open the existing database at `path` with WAL + relaxed fsync PRAGMAs
+    and sqlite3.Row rows; raises sqlite3.OperationalError if it is missing.
+    """
+    # mode=rw: never create an empty database in place of a missing one
+    db = sqlite3.connect(
+        Path(path).resolve().as_uri() + "?mode=rw",
+        uri=True,
+        isolation_level=isolation_level,
+        check_same_thread=check_same_thread,
+    )
+    db.row_factory = sqlite3.Row
+    db.executescript(PRAGMAS)
+    return db
+
+
+_shared: dict[Path, sqlite3.Connection] = {}
+
+
+def shared_db(path: Path) -> sqlite3.Connection:
+    """
+    Return the process-wide autocommit connection for `path`.
+
+    Callers wrap multi-statement writes in explicit BEGIN/COMMIT and
+    must not close the connection themselves; see close_shared_db().
+    """
+    path = Path(path).resolve()
+    if path not in _shared:
+        # run_all may hand the connection to steps on different worker threads;
+        # their DEPENDS_ON ordering keeps the use sequential.
+        _shared[path] = open_db(path, isolation_level=None, check_same_thread=False)
+    return _shared[path]
+
+
+def close_shared_db(path: Path):
+    """Run PRAGMA optimize and close the shared connection for `path`, if open."""
+    db = _shared.pop(Path(path).resolve(), None)
+    if db is None:
+        return
+    # Refresh planner stats for the Tabby server that opens the DB next
+    try:
+        db.execute("PRAGMA optimize")
+    except sqlite3.Error:
+        pass
+    db.close()
+
+
+@atexit.register
+def _close_all_shared():
+    # Fallback for a step run on its own (or one that failed first)
+    for path in list(_shared):
+        close_shared_db(path)
@@ -51,11 +51,21 @@
 #     different GPU instances in the classroom.
 # =====================================================================
 
+import http.client
 import json
 import os
 import sys
 import urllib.parse
-import urllib.request
+
+# Only talks to the Cloudflare API, so run_all may run it concurrently
+# with the Ollama setup.
+DEPENDS_ON: list[str] = []
+
+CF_API_HOST = "api.cloudflare.com"
+
+# One keep-alive TLS connection shared by all API calls (lookup + upsert),
+# so only the first request pays for the handshake.
+_conn = http.client.HTTPSConnection(CF_API_HOST, timeout=15)
 
 
 # ==========================================================
@@ -81,14 +91,14 @@ def api_request(method: str, url: str, api_token: str, body: dict | None = None)
     if body is not None:
         data = json.dumps(body).encode("utf-8")
 
-    req = urllib.request.Request(url, data=data, method=method)
-    for k, v in headers.items():
-        req.add_header(k, v)
+    parts = urllib.parse.urlsplit(url)
+    path = parts.path + (f"?{parts.query}" if parts.query else "")
 
     try:
-        with urllib.request.urlopen(req, timeout=15) as resp:
-            raw = resp.read().decode("utf-8")
+        _conn.request(method, path, body=data, headers=headers)
+        raw = _conn.getresponse().read().decode("utf-8")
     except Exception as e:
+        _conn.close()
         log(f"❌ HTTP request to Cloudflare failed: {e}")
         sys.exit(1)
 
@@ -121,6 +131,8 @@ def upsert_a_record(
     """
     Create or update an A record for `fqdn` in the given Cloudflare zone.
 
+    - If a matching A record already has the desired content, TTL and
+      proxy flag, it is returned unchanged (no PUT).
     - If a matching A record already exists, it is updated.
     - If none exists, a new record is created.
 
@@ -151,6 +163,10 @@ def upsert_a_record(
     }
 
     # 2) Update existing record or create new one
+    if records and all(records[0].get(k) == v for k, v in payload.items()):
+        log("✅ A record already correct — no change.")
+        return records[0]
+
     if records:
         record_id = records[0]["id"]
         update_url = f"{base}/{record_id}"
@@ -8,7 +8,8 @@
 #
 # ACTIONS:
 #   1. Install Ollama if missing.
-#   2. Configure Ollama to listen on all interfaces (0.0.0.0).
+#   2. Configure Ollama to listen on all interfaces (0.0.0.0) and to
+#      serve parallel requests with both models kept loaded.
 #   3. Ensure Ollama service (systemd or manual) is running.
 #   4. Pull required models:
 #        - deepseek-coder:6.7b  (autocomplete)
@@ -20,11 +21,21 @@
 #   - From code:   from ollama_setup import 10_setup_ollama; 10_setup_ollama.main()
 # =====================================================================
 
+import json
+import os
 import subprocess
 import shutil
+import socket
 import sys
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
+# Independent of the DNS update; run_all may run both concurrently.
+DEPENDS_ON: list[str] = []
+
 # ==========================================================
 # 🔧 Configuration
 # ==========================================================
@@ -33,6 +44,19 @@ REQUIRED_MODELS = {
     "qwen2.5-coder:7b": "chat",
 }
 
+OLLAMA_HOST = "127.0.0.1"
+OLLAMA_PORT = 11434
+OLLAMA_API = f"http://{OLLAMA_HOST}:{OLLAMA_PORT}"
+
+# Server environment: listen on all interfaces, serve several editor sessions
+# per model at once, and keep both required models resident between requests.
+OLLAMA_SERVER_ENV = {
+    "OLLAMA_HOST": "0.0.0.0",
+    "OLLAMA_NUM_PARALLEL": "8",
+    "OLLAMA_MAX_LOADED_MODELS": str(len(REQUIRED_MODELS)),
+    "OLLAMA_KEEP_ALIVE": "24h",
+}
+
 # ==========================================================
 # 🧩 Utility helpers
 # ==========================================================
@@ -42,12 +66,17 @@ def log(msg: str):
 
 def run(cmd: list[str], check=True, capture_output=False):
     """Run a shell command with clean error output."""
+    # An absolute executable plus close_fds=False lets CPython launch via
+    # posix_spawn instead of fork+exec. Python's own fds are
+    # non-inheritable (PEP 446), so nothing extra leaks to the child.
+    exe = shutil.which(cmd[0]) or cmd[0]
     try:
         result = subprocess.run(
-            cmd,
+            [exe, *cmd[1:]],
             check=check,
             capture_output=capture_output,
             text=True,
+            close_fds=False,
         )
         return result.stdout.strip() if capture_output else ""
     except subprocess.CalledProcessError as e:
@@ -61,6 +90,70 @@ def run(cmd: list[str], check=True, capture_output=False):
         return ""
 
 
+def ollama_listening(timeout: float = 0.2) -> bool:
+    """True if something accepts connections on the Ollama API port."""
+    try:
+        with socket.create_connection((OLLAMA_HOST, OLLAMA_PORT), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+
+def wait_for_ollama(timeout: float = 5.0, interval: float = 0.05) -> bool:
+    """Poll the API port until the daemon accepts connections or `timeout` expires."""
+    start = time.monotonic()
+    while not ollama_listening(timeout=0.1):
+        if time.monotonic() - start >= timeout:
+            log(f"⚠️  Ollama not reachable on {OLLAMA_HOST}:{OLLAMA_PORT} after {timeout:g}s.")
+            return False
+        time.sleep(interval)
+    log(f"✅ Ollama API ready ({time.monotonic() - start:.2f}s).")
+    return True
+
+
+def list_installed_models() -> set[str]:
+    """Return installed model names from the Ollama API (same names as `ollama list`)."""
+    try:
+        with urllib.request.urlopen(f"{OLLAMA_API}/api/tags", timeout=10) as resp:
+            tags = json.load(resp)
+    except Exception as e:
+        log(f"❌ Could not query installed models from {OLLAMA_API}: {e}")
+        sys.exit(1)
+    return {m["name"] for m in tags.get("models", [])}
+
+
+def pull_model(model: str, cancel: threading.Event | None = None) -> bool:
+    """
+    Pull `model` via POST /api/pull; blocks until the download finishes.
+
+    The streamed status lines are read (not printed) so that `cancel` is
+    noticed within one progress update; closing the connection makes the
+    server drop the pull. Returns False if cancelled.
+    """
+    req = urllib.request.Request(
+        f"{OLLAMA_API}/api/pull",
+        data=json.dumps({"name": model}).encode(),
+        headers={"Content-Type": "application/json"},
+    )
+    status = None
+    try:
+        with urllib.request.urlopen(req, timeout=None) as resp:
+            for line in resp:
+                if cancel is not None and cancel.is_set():
+                    return False
+                result = json.loads(line)
+                if "error" in result:
+                    raise RuntimeError(result["error"])
+                status = result.get("status")
+    except Exception as e:
+        log(f"❌ Pull of {model} failed: {e}")
+        sys.exit(1)
+    if status != "success":
+        log(f"❌ Pull of {model} failed: last status {status!r}")
+        sys.exit(1)
+    return True
+
+
 def sudo_write(path: Path, content: str):
     """Create parent dir and write file as root using sudo."""
     run(["sudo", "mkdir", "-p", str(path.parent)])
@@ -98,10 +191,10 @@ def configure_remote_access():
 
     override_dir = Path("/etc/systemd/system/ollama.service.d")
     override_file = override_dir / "override.conf"
-    desired = '[Service]\nEnvironment="OLLAMA_HOST=0.0.0.0"\n'
+    desired = "[Service]\n" + "".join(f'Environment="{k}={v}"\n' for k, v in OLLAMA_SERVER_ENV.items())
 
     current = run(["sudo", "cat", str(override_file)], check=False, capture_output=True)
-    if current == desired:
+    if current == desired.strip():  # run() strips the trailing newline
         log("✅ systemd override already in place.")
         return
 
@@ -114,53 +207,88 @@ def configure_remote_access():
 # ==========================================================
 # ⚙️  Ensure Ollama service or process is running
 # ==========================================================
+def ollama_service_state() -> str:
+    """ActiveState of ollama.service ("active", "inactive", ...)."""
+    try:
+        # optional: ask systemd over D-Bus instead of forking systemctl
+        from pystemd.systemd1 import Unit
+        unit = Unit(b"ollama.service")
+        unit.load()
+        return unit.Unit.ActiveState.decode()
+    except Exception:
+        return run(["systemctl", "is-active", "ollama"], check=False, capture_output=True)
+
+
 def ensure_ollama_running():
     if shutil.which("systemctl"):
-        status = run(["systemctl", "is-active", "ollama"], check=False, capture_output=True)
-        if status.strip() != "active":
+        if ollama_service_state() != "active":
             log("⚙️  Ollama service not active — attempting to start...")
             run(["sudo", "systemctl", "start", "ollama"], check=False)
         else:
             log("✅ Ollama systemd service is active.")
-        return
-
-    ps = run(["ps", "-A"], capture_output=True)
-    if "ollama" not in ps:
+    elif not ollama_listening():
         log("⚙️  Starting Ollama manually in background ...")
-        subprocess.Popen(["ollama", "serve"])
+        subprocess.Popen(["ollama", "serve"], env={**os.environ, **OLLAMA_SERVER_ENV})
     else:
         log("✅ Ollama process already running.")
 
+    # A (re)started daemon needs a moment before `ollama list`/`pull` work.
+    wait_for_ollama()
+
 
 # ==========================================================
 # 📦  Ensure required models exist
 # ==========================================================
-def ensure_models_installed():
-    existing = run(["ollama", "list"], capture_output=True).splitlines()
-    existing_models = {line.split()[0] for line in existing if line.strip() and not line.startswith("NAME")}
-
+def ensure_models_installed(installed: set[str]):
+    missing = []
     for model, role in REQUIRED_MODELS.items():
-        if model in existing_models:
+        if model in installed:
             log(f"✅ {model} ({role}) already installed.")
         else:
-            log(f"⬇️  Pulling {model} for {role} — this may take several minutes ...")
-            run(["ollama", "pull", model])
-            log(f"✅ {model} installed.")
+            missing.append(model)
+
+    if not missing:
+        return
+
+    # The Ollama server handles concurrent pulls; layer downloads overlap.
+    # Pulling through the API skips the CLI's progress-bar output entirely.
+    # The first failure cancels the other pulls instead of waiting for them.
+    cancel = threading.Event()
+    failed = []
+    with ThreadPoolExecutor(max_workers=len(missing)) as pool:
+        futures = {}
+        for model in missing:
+            log(f"⬇️  Pulling {model} for {REQUIRED_MODELS[model]} — this may take several minutes ...")
+            futures[pool.submit(pull_model, model, cancel)] = model
+        for future in as_completed(futures):
+            model = futures[future]
+            try:
+                if future.result():
+                    installed.add(model)
+                    log(f"✅ {model} installed.")
+            except SystemExit:
+                failed.append(model)
+                cancel.set()
+                pool.shutdown(wait=False, cancel_futures=True)
+
+    if failed:
+        log(f"❌ Could not install: {', '.join(failed)}")
+        sys.exit(1)
 
 
 # ==========================================================
 # 🧹  Remove unused models (optional)
 # ==========================================================
-def cleanup_unused_models():
+def cleanup_unused_models(installed: set[str]):
     log("🧹 Checking for unused models ...")
-    existing = run(["ollama", "list"], capture_output=True).splitlines()
-    for line in existing:
-        if not line.strip() or line.startswith("NAME"):
-            continue
-        name = line.split()[0]
-        if name not in REQUIRED_MODELS:
-            log(f"   Removing unused model: {name}")
-            run(["ollama", "rm", name])
+    unused = installed - REQUIRED_MODELS.keys()
+    if not unused:
+        log("✅ Nothing to clean.")
+        return
+    for name in sorted(unused):
+        log(f"   Removing unused model: {name}")
+        run(["ollama", "rm", name])
+        installed.discard(name)
     log("✅ Cleanup complete.")
 
 
@@ -172,8 +300,9 @@ def main():
     ensure_ollama_installed()
     configure_remote_access()
     ensure_ollama_running()
-    ensure_models_installed()
-    cleanup_unused_models()
+    installed = list_installed_models()
+    ensure_models_installed(installed)
+    cleanup_unused_models(installed)
 
     log("\n🎉 Ollama setup complete! Models ready:")
     for model, role in REQUIRED_MODELS.items():
@@ -15,22 +15,35 @@
 #
 # What it does:
 #   - Finds the latest models_YYYY-MM-DD.tar.zst in s3://<bucket>/model-backups/
-#   - Downloads archive (+ .sha256 if present)
-#   - Verifies SHA256
+#   - Downloads archive (+ .sha256 if present), or with --stream pipes it
+#     straight into zstd | tar and verifies afterwards
+#   - Verifies SHA256 (hashed while downloading)
 #   - Extracts into HOME (so 'tabbyclassmodels/models' ends under ~)
 # ==========================================================
+import argparse
 import os
 import tempfile
 import sys
 sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
 
-from include.s3_utils import *
+import botocore.exceptions
+from include.s3_utils import (
+    DEFAULT_BUCKET,
+    DEFAULT_ENDPOINT,
+    DEFAULT_PROFILE,
+    download_file,
+    extract_archive_to_home,
+    find_latest_backup,
+    get_s3_client,
+    log,
+    stream_extract_to_home,
+)
 
 
-def restore_models(bucket=DEFAULT_BUCKET, endpoint=DEFAULT_ENDPOINT, profile=DEFAULT_PROFILE):
+def restore_models(bucket=DEFAULT_BUCKET, endpoint=DEFAULT_ENDPOINT, profile=DEFAULT_PROFILE, stream=False):
     """Restore Tabby model data from Hetzner S3."""
     s3 = get_s3_client(profile, endpoint)
-    key = find_latest_backup(s3, bucket, "model-backups/")
+    key = find_latest_backup(s3, bucket, "model-backups/", stem="models")
     if not key:
         log("❌ No model backup found.")
         return
@@ -42,20 +55,30 @@ def restore_models(bucket=DEFAULT_BUCKET, endpoint=DEFAULT_ENDPOINT, profile=DEF
     local_archive = os.path.join(tmpdir, archive)
     local_checksum = local_archive + ".sha256"
 
-    download_file(s3, bucket, key, local_archive)
-
-    have_checksum = True
+    expected = None
     try:
         download_file(s3, bucket, checksum_key, local_checksum)
+        with open(local_checksum) as f:
+            expected = f.read().split()[0]
     except botocore.exceptions.ClientError:
         log("⚠️ No checksum file found, skipping verification.")
-        have_checksum = False
 
-    if have_checksum:
-        with open(local_checksum) as f:
-            expected = f.read().split()[0]
+    if stream:
+        log("🌊 Streaming archive directly into ~ ...")
+        actual = stream_extract_to_home(s3, bucket, key)
+        if expected is None or actual == expected:
+            if expected:
+                log("✅ Checksum OK.")
+            log("🎉 Restore complete under ~/tabbyclassmodels/models")
+            return
+        # Files are already extracted; redo it from a verified copy on disk
+        log("❌ Checksum mismatch on streamed archive! Falling back to on-disk restore ...")
+
+    actual = download_file(s3, bucket, key, local_archive)
+
+    if expected:
         log("🔢 Verifying checksum ...")
-        if verify_sha256(local_archive, expected):
+        if actual == expected:
             log("✅ Checksum OK.")
         else:
             log("❌ Checksum mismatch! Aborting.")
@@ -66,4 +89,7 @@ def restore_models(bucket=DEFAULT_BUCKET, endpoint=DEFAULT_ENDPOINT, profile=DEF
 
 
 if __name__ == "__main__":
-    restore_models()
+    parser = argparse.ArgumentParser(description="Restore Tabby model backup ← Hetzner S3")
+    parser.add_argument("--stream", action="store_true",
+                        help="Pipe the archive from S3 straight into zstd | tar (no local copy)")
+    restore_models(stream=parser.parse_args().stream)
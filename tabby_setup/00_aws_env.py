@@ -19,17 +19,51 @@
 #   AWS_REGION               – optional (default fsn1)
 # ==========================================================
 
+import functools
 import os
 import sys
 import shutil
 import subprocess
+import time
 from pathlib import Path
 
+APT_LISTS = Path("/var/lib/apt/lists")
+APT_MAX_AGE = 24 * 3600  # seconds; cloud images usually refresh on first boot
+
 
 def log(msg: str):
     print(msg, flush=True)
 
 
+@functools.lru_cache(maxsize=None)
+def which(cmd: str) -> str | None:
+    """shutil.which, walking PATH only once per command."""
+    return shutil.which(cmd)
+
+
+def apt_lists_fresh(max_age: float = APT_MAX_AGE) -> bool:
+    """True if the apt package index was refreshed within `max_age` seconds."""
+    try:
+        with os.scandir(APT_LISTS) as entries:
+            newest = max((e.stat().st_mtime for e in entries
+                          if e.is_file() and e.name != "lock"), default=0)
+    except OSError:
+        return False
+    return time.time() - newest < max_age
+
+
+def atomic_write(path: Path, content: str, mode: int = 0o600):
+    """Write via a fsynced temp file + os.replace, so `path` is never left torn."""
+    tmp = path.with_name(path.name + ".tmp")
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode)
+    try:
+        os.write(fd, content.encode("utf-8"))
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    os.replace(tmp, path)
+
+
 def ensure_aws_env():
     """Create AWS credential/config files if not present."""
     profile = os.getenv("AWS_PROFILE", "hetzner")
@@ -51,25 +85,35 @@ def ensure_aws_env():
     cred_content = f"[{profile}]\naws_access_key_id = {access_key}\naws_secret_access_key = {secret_key}\n"
     config_content = f"[profile {profile}]\nregion = {region}\noutput = json\n"
 
-    cred_file.write_text(cred_content, encoding="utf-8")
-    config_file.write_text(config_content, encoding="utf-8")
+    atomic_write(cred_file, cred_content)
+    atomic_write(config_file, config_content)
 
     log(f"✅ AWS profile '{profile}' configured (region={region}) at {aws_dir}")
 
 
-def ensure_zstd():
-    """Ensure zstd is installed."""
-    if shutil.which("zstd") is None:
+def ensure_zstd(apt_update: subprocess.Popen | None = None):
+    """Ensure zstd is installed; `apt_update` is an already running `apt-get update`."""
+    zstd = which("zstd")
+    if zstd is None:
         log("⚙️  Installing zstd (missing)...")
-        subprocess.run(["sudo", "apt-get", "update", "-qq"], check=True)
+        if apt_update is None:
+            if not apt_lists_fresh():
+                subprocess.run(["sudo", "apt-get", "update", "-qq"], check=True)
+        elif apt_update.wait() != 0:
+            raise subprocess.CalledProcessError(apt_update.returncode, apt_update.args)
         subprocess.run(["sudo", "apt-get", "install", "-y", "zstd"], check=True)
+        which.cache_clear()
     else:
-        log(f"✅ zstd found at {shutil.which('zstd')}")
+        log(f"✅ zstd found at {zstd}")
 
 
 def main():
+    # Start the slow apt index refresh first so it overlaps the file writes
+    apt_update = None
+    if which("zstd") is None and not apt_lists_fresh():
+        apt_update = subprocess.Popen(["sudo", "apt-get", "update", "-qq"])
     ensure_aws_env()
-    ensure_zstd()
+    ensure_zstd(apt_update)
     log("🎉 AWS environment ready for S3 restore scripts.")
 
 
@@ -33,16 +33,15 @@ import tempfile
 import sys
 from pathlib import Path
 sys.path.append(str(Path(__file__).resolve().parent.parent))
+from concurrent.futures import ThreadPoolExecutor
 from include.s3_utils import (
     get_s3_client,
     find_latest_backup,
     download_file,
-    verify_sha256,
     extract_archive_to_home,
     DEFAULT_BUCKET,
     DEFAULT_ENDPOINT,
     DEFAULT_PROFILE,
-    botocore,
     log,
 )
 
@@ -59,8 +58,10 @@ def restore_db(bucket=DEFAULT_BUCKET, endpoint=DEFAULT_ENDPOINT, profile=DEFAULT
     Returns:
         bool: True if restore succeeded, False otherwise.
     """
+    from botocore.exceptions import ClientError
+
     s3 = get_s3_client(profile, endpoint)
-    key = find_latest_backup(s3, bucket, "db-backups/")
+    key = find_latest_backup(s3, bucket, "db-backups/", stem="db")
     if not key:
         log("❌ No DB backup found.")
         return False
@@ -72,12 +73,15 @@ def restore_db(bucket=DEFAULT_BUCKET, endpoint=DEFAULT_ENDPOINT, profile=DEFAULT
     local_archive = os.path.join(tmpdir, archive)
     local_checksum = local_archive + ".sha256"
 
-    download_file(s3, bucket, key, local_archive)
+    # Fetch the tiny .sha256 sidecar alongside the archive over the shared client
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        checksum_download = pool.submit(download_file, s3, bucket, checksum_key, local_checksum)
+        actual = download_file(s3, bucket, key, local_archive)
 
     have_checksum = True
     try:
-        download_file(s3, bucket, checksum_key, local_checksum)
-    except botocore.exceptions.ClientError:
+        checksum_download.result()
+    except ClientError:
         log("⚠️ No checksum file found, skipping verification.")
         have_checksum = False
 
@@ -85,7 +89,7 @@ def restore_db(bucket=DEFAULT_BUCKET, endpoint=DEFAULT_ENDPOINT, profile=DEFAULT
         with open(local_checksum) as f:
             expected = f.read().split()[0]
         log("🔢 Verifying checksum ...")
-        if verify_sha256(local_archive, expected):
+        if actual == expected:
             log("✅ Checksum OK.")
         else:
             log("❌ Checksum mismatch! Aborting.")
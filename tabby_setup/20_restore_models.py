@@ -5,6 +5,10 @@
 # Designed for ephemeral GPU instances (Lambda, Hetzner, Scaleway)
 #
 # Adds simple progress feedback during large S3 downloads.
+#
+# Set TABBY_RESTORE_STREAM=1 to pipe the archive from S3 straight
+# into zstd | tar (no copy in /tmp); the checksum is then verified
+# after extraction, falling back to a verified on-disk restore.
 # ==========================================================
 
 import sys
@@ -12,22 +16,32 @@ from pathlib import Path
 sys.path.append(str(Path(__file__).resolve().parent.parent))
 import os
 import tempfile
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from include.s3_utils import (
     get_s3_client,
+    download_file,
     find_latest_backup,
-    verify_sha256,
     extract_archive_to_home,
     DEFAULT_BUCKET,
     DEFAULT_ENDPOINT,
     DEFAULT_PROFILE,
-    botocore,
     log,
+    stream_extract_to_home,
 )
 
+# Only needs the AWS profile; run_all restores the DB alongside it.
+DEPENDS_ON = ["00_aws_env"]
+
 
-def download_file_with_progress(s3, bucket, key, dest_path, chunk_size=8 * 1024 * 1024):
-    """Download a file from S3 with basic progress feedback (no extra deps)."""
+def download_file_with_progress(s3, bucket, key, dest_path, interval=0.25):
+    """Download a file from S3 with basic progress feedback (no extra deps).
+
+    Uses the threaded ranged download from s3_utils; the progress line is
+    redrawn at most every `interval` seconds. Returns the SHA256 of the
+    downloaded bytes, hashed on the way to disk.
+    """
     log(f"🔽 Downloading {key} → {dest_path}")
     try:
         obj = s3.head_object(Bucket=bucket, Key=key)
@@ -35,30 +49,37 @@ def download_file_with_progress(s3, bucket, key, dest_path, chunk_size=8 * 1024
     except Exception:
         total = 0
 
-    start = time.time()
+    start = time.monotonic()
     bytes_done = 0
-    with open(dest_path, "wb") as f:
-        response = s3.get_object(Bucket=bucket, Key=key)
-        body = response["Body"]
-        while True:
-            chunk = body.read(chunk_size)
-            if not chunk:
-                break
-            f.write(chunk)
-            bytes_done += len(chunk)
+    last_print = 0.0
+    lock = threading.Lock()
+
+    def progress(n):
+        nonlocal bytes_done, last_print
+        with lock:  # called from several transfer threads
+            bytes_done += n
+            now = time.monotonic()
+            if now - last_print < interval:
+                return
+            last_print = now
             if total:
                 pct = bytes_done * 100 // total
                 print(f"\r   Progress: {pct:3d}% ({bytes_done/1e6:.1f}/{total/1e6:.1f} MB)", end="", flush=True)
             else:
                 print(f"\r   Downloaded {bytes_done/1e6:.1f} MB", end="", flush=True)
-    dur = time.time() - start
+
+    sha256 = download_file(s3, bucket, key, dest_path, callback=progress)
+    dur = time.monotonic() - start
     print(f"\n✅ Download complete ({bytes_done/1e6:.1f} MB in {dur:.1f}s)")
+    return sha256
 
 
-def restore_models(bucket=DEFAULT_BUCKET, endpoint=DEFAULT_ENDPOINT, profile=DEFAULT_PROFILE):
+def restore_models(bucket=DEFAULT_BUCKET, endpoint=DEFAULT_ENDPOINT, profile=DEFAULT_PROFILE, stream=False):
     """Restore Tabby model data from Hetzner S3."""
+    from botocore.exceptions import ClientError
+
     s3 = get_s3_client(profile, endpoint)
-    key = find_latest_backup(s3, bucket, "model-backups/")
+    key = find_latest_backup(s3, bucket, "model-backups/", stem="models")
     if not key:
         log("❌ No model backup found.")
         return False
@@ -70,12 +91,19 @@ def restore_models(bucket=DEFAULT_BUCKET, endpoint=DEFAULT_ENDPOINT, profile=DEF
     local_archive = os.path.join(tmpdir, archive)
     local_checksum = local_archive + ".sha256"
 
-    download_file_with_progress(s3, bucket, key, local_archive)
+    # Fetch the tiny .sha256 sidecar alongside the archive over the shared client
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        checksum_download = pool.submit(download_file, s3, bucket, checksum_key, local_checksum)
+        if stream:
+            log("🌊 Streaming archive directly into ~ ...")
+            actual = stream_extract_to_home(s3, bucket, key)
+        else:
+            actual = download_file_with_progress(s3, bucket, key, local_archive)
 
     have_checksum = True
     try:
-        download_file_with_progress(s3, bucket, checksum_key, local_checksum)
-    except botocore.exceptions.ClientError:
+        checksum_download.result()
+    except ClientError:
         log("⚠️ No checksum file found, skipping verification.")
         have_checksum = False
 
@@ -83,13 +111,18 @@ def restore_models(bucket=DEFAULT_BUCKET, endpoint=DEFAULT_ENDPOINT, profile=DEF
         with open(local_checksum) as f:
             expected = f.read().split()[0]
         log("🔢 Verifying checksum ...")
-        if verify_sha256(local_archive, expected):
+        if actual == expected:
             log("✅ Checksum OK.")
+        elif stream:
+            # Files are already extracted; redo it from a verified copy on disk
+            log("❌ Checksum mismatch on streamed archive! Falling back to on-disk restore ...")
+            return restore_models(bucket, endpoint, profile, stream=False)
         else:
             log("❌ Checksum mismatch! Aborting.")
             return False
 
-    extract_archive_to_home(local_archive)
+    if not stream:
+        extract_archive_to_home(local_archive)
     log("🎉 Restore complete under ~/tabbyclassmodels/models")
     return True
 
@@ -100,7 +133,9 @@ def main():
     endpoint = os.getenv("TABBY_S3_ENDPOINT", DEFAULT_ENDPOINT)
     profile = os.getenv("AWS_PROFILE", DEFAULT_PROFILE)
 
-    success = restore_models(bucket, endpoint, profile)
+    stream = os.getenv("TABBY_RESTORE_STREAM") == "1"
+
+    success = restore_models(bucket, endpoint, profile, stream)
     if not success:
         sys.exit(1)
 
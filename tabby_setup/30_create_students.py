@@ -21,6 +21,8 @@
 #
 # Environment:
 #   No arguments or variables required.
+#   TABBY_REPO_HASH (optional) is stamped into the CSVs instead
+#   of the commit read from .git.
 #   Database is expected at ~/tabbyclassmodels/ee/db.sqlite
 # ==========================================================
 
@@ -30,20 +32,24 @@ sys.path.append(str(Path(__file__).resolve().parent.parent))
 import os
 import re
 import csv
+import functools
 import smtplib
-import secrets
-import sqlite3
 import subprocess
 from datetime import datetime, UTC
 from email.message import EmailMessage
+from include.sqlite_utils import shared_db
 
 # ---------------------------------------------------------------------
 # Configuration
 # ---------------------------------------------------------------------
 
+REPO_ROOT = Path(__file__).resolve().parent.parent
 CLASSES_DIR = Path(__file__).parent.parent / "classes"
 DB_PATH = Path.home() / "tabbyclassmodels" / "ee" / "db.sqlite"
 
+# Needs the restored DB, not the models being restored alongside it.
+DEPENDS_ON = ["10_restore_db"]
+
 MAIL_ENABLED = False
 SMTP_SERVER = "smtp.yourschool.de"
 SMTP_PORT = 587
@@ -51,6 +57,12 @@ SMTP_USER = "teacher@sabel.education"
 SMTP_PASS = "YOUR_SMTP_PASSWORD"
 SENDER_NAME = "Tabby Classroom Server"
 
+INSERT_USER_SQL = """
+    INSERT INTO users (email, name, is_admin, created_at, updated_at, auth_token, active)
+    VALUES (?, ?, 0, ?, ?, ?, 1)
+    ON CONFLICT(email) DO NOTHING
+"""
+
 # ---------------------------------------------------------------------
 # Helper functions
 # ---------------------------------------------------------------------
@@ -60,20 +72,65 @@ def log(msg):
     print(msg, flush=True)
 
 
+# Leading \s* replaces a line.strip(); trailing whitespace never matters to match()
+LINE_RE = re.compile(r'\s*"\s*([^"]+)\s*"\s*<([^>]+)>')
+
+
 def parse_line(line: str):
     """Extract (name, email) from lines like: "Name" <email>"""
-    match = re.match(r'"\s*([^"]+)\s*"\s*<([^>]+)>', line.strip())
+    # Fast path for the usual shape; anything unusual goes through LINE_RE
+    s = line.lstrip()
+    if s.startswith('"'):
+        q = s.find('"', 1)
+        lt = s.find("<", q + 1)
+        gt = s.find(">", lt + 1)
+        if q > 1 and lt > q and gt > lt + 1 and not s[q + 1:lt].strip():
+            return s[1:q].strip(), s[lt + 1:gt].strip().lower()
+
+    match = LINE_RE.match(line)
     if match:
         name, email = match.groups()
         return name.strip(), email.strip().lower()
     return None, None
 
 
+def read_students(path: Path):
+    """Yield (name, email) per roster line; blank and # comment lines skip the regex."""
+    with open(path, encoding="utf-8", buffering=1 << 16) as f:
+        for line in f:
+            line = line.lstrip()
+            if not line or line[0] == "#":
+                continue
+            name, email = parse_line(line)
+            if email:
+                yield name, email
+
+
+@functools.lru_cache(maxsize=1)
 def get_repo_hash() -> str:
-    """Return short git commit hash if available."""
+    """Return short git commit hash if available (TABBY_REPO_HASH overrides)."""
+    if override := os.getenv("TABBY_REPO_HASH"):
+        return override
+    # Resolve HEAD from .git directly; git itself is only the fallback
+    git_dir = REPO_ROOT / ".git"
+    try:
+        head = (git_dir / "HEAD").read_text().strip()
+        if not head.startswith("ref: "):
+            return head[:7]  # detached HEAD
+        ref = head[5:]
+        ref_file = git_dir / ref
+        if ref_file.exists():
+            return ref_file.read_text().strip()[:7]
+        for line in (git_dir / "packed-refs").read_text().splitlines():
+            if line.endswith(" " + ref):
+                return line[:7]
+    except OSError:
+        pass
+
     try:
         result = subprocess.run(
             ["git", "rev-parse", "--short", "HEAD"],
+            cwd=REPO_ROOT,
             stdout=subprocess.PIPE,
             stderr=subprocess.DEVNULL,
             text=True,
@@ -84,8 +141,8 @@ def get_repo_hash() -> str:
         return "n/a"
 
 
-def send_token_mail(name, email, token):
-    """Send email with login token to student (optional)."""
+def send_token_mail(name, email, token, server=None):
+    """Send email with login token to student (optional); reuses `server` if given."""
     msg = EmailMessage()
     msg["Subject"] = "Your Tabby access token"
     msg["From"] = f"{SENDER_NAME} <{SMTP_USER}>"
@@ -106,15 +163,30 @@ Best regards,
 """
     )
     try:
-        with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
-            server.starttls()
-            server.login(SMTP_USER, SMTP_PASS)
+        if server is not None:
             server.send_message(msg)
+        else:
+            with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
+                server.starttls()
+                server.login(SMTP_USER, SMTP_PASS)
+                server.send_message(msg)
         log(f"📨 Sent token to {email}")
     except Exception as e:
         log(f"⚠️  Failed to send mail to {email}: {e}")
 
 
+def send_token_mails(recipients):
+    """Send all token mails over one SMTP session (one STARTTLS + login)."""
+    try:
+        with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
+            server.starttls()
+            server.login(SMTP_USER, SMTP_PASS)
+            for name, email, token in recipients:
+                send_token_mail(name, email, token, server=server)
+    except Exception as e:
+        log(f"⚠️  SMTP session to {SMTP_SERVER} failed: {e}")
+
+
 # ---------------------------------------------------------------------
 # Core functionality
 # ---------------------------------------------------------------------
@@ -126,63 +198,110 @@ def create_students():
         log(f"❌ Database not found at {DB_PATH}")
         return False
 
-    db = sqlite3.connect(DB_PATH)
-    db.row_factory = sqlite3.Row
+    student_files = sorted(CLASSES_DIR.glob("*.txt"))
+    if not student_files:
+        log(f"⚠️ No student list files found in {CLASSES_DIR}")
+        return False
 
+    # Autocommit connection shared with later steps; the whole run is one
+    # explicit transaction (one fsync).
+    db = shared_db(DB_PATH)
+
+    # Only stamped into the CSVs, so resolve it once there is something to write
     repo_hash = get_repo_hash()
     timestamp = datetime.now(UTC).strftime("%Y-%m-%d %H:%M:%S UTC")
 
     log(f"📦 Version info: commit={repo_hash}, generated_at={timestamp}")
 
-    student_files = sorted(CLASSES_DIR.glob("*.txt"))
-    if not student_files:
-        log(f"⚠️ No student list files found in {CLASSES_DIR}")
-        return False
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        ensure_unique_email_index(db)
+        mail_queue = process_files(db, student_files, timestamp, repo_hash)
+    except BaseException:
+        db.execute("ROLLBACK")
+        raise
+    db.execute("COMMIT")
+
+    # Mail only once the tokens are committed
+    if mail_queue:
+        send_token_mails(mail_queue)
+    log("\n🎉 All students processed successfully.")
+    return True
+
+
+def ensure_unique_email_index(db):
+    """ON CONFLICT(email) needs a unique index on users.email; create one only if missing."""
+    for index in db.execute("PRAGMA index_list(users)"):
+        columns = [col["name"] for col in db.execute(
+            "SELECT name FROM pragma_index_info(?) ORDER BY seqno", (index["name"],)
+        )]
+        if index["unique"] and columns == ["email"]:
+            return
+    db.execute("CREATE UNIQUE INDEX IF NOT EXISTS ux_users_email ON users(email)")
+
+
+def existing_tokens(db, emails: list[str]) -> dict[str, str]:
+    """Map each already registered email to its auth_token in a single query."""
+    if not emails:
+        return {}
+    placeholders = ",".join("?" * len(emails))
+    rows = db.execute(
+        f"SELECT email, auth_token FROM users WHERE email IN ({placeholders})", emails
+    )
+    return {row["email"].lower(): row["auth_token"] for row in rows}
 
+
+def new_tokens(count: int) -> list[str]:
+    """Return `count` fresh auth tokens drawn from a single os.urandom call."""
+    buf = os.urandom(16 * count)
+    return ["auth_" + buf[i:i + 16].hex() for i in range(0, len(buf), 16)]
+
+
+def process_files(db, student_files, timestamp, repo_hash):
+    """
+    Create missing users for each class list and write its tokens CSV.
+
+    Returns the (name, email, token) rows to mail if MAIL_ENABLED.
+    """
+    mail_queue = []
+    created_at = timestamp.removesuffix(" UTC")  # same instant for every new row
     for file in student_files:
         output_file = file.with_suffix(".tokens.csv")
         log(f"\n📂 Processing {file.name}")
 
-        with open(output_file, "w", newline="", encoding="utf-8") as out_csv:
-            writer = csv.writer(out_csv)
-            writer.writerow(["name", "email", "auth_token", "generated_at", "repo_hash"])
-
-            with open(file, encoding="utf-8") as f:
-                for line in f:
-                    name, email = parse_line(line)
-                    if not email:
-                        continue
-
-                    existing = db.execute(
-                        "SELECT auth_token FROM users WHERE email = ?", (email,)
-                    ).fetchone()
-
-                    if existing:
-                        token = existing["auth_token"]
-                        log(f"ℹ️  Existing: {name} ({email})")
-                    else:
-                        token = "auth_" + secrets.token_hex(16)
-                        now = datetime.now(UTC).strftime("%Y-%m-%d %H:%M:%S")
-                        db.execute(
-                            """
-                            INSERT INTO users (email, name, is_admin, created_at, updated_at, auth_token, active)
-                            VALUES (?, ?, 0, ?, ?, ?, 1)
-                            """,
-                            (email, name, now, now, token),
-                        )
-                        log(f"✅ Added {name} ({email})")
-
-                    writer.writerow([name, email, token, timestamp, repo_hash])
-
-                    if MAIL_ENABLED:
-                        send_token_mail(name, email, token)
+        # email -> name; a student listed twice keeps the first entry and
+        # gets a single account, CSV row and mail.
+        students = {}
+        for name, email in read_students(file):
+            students.setdefault(email, name)
+
+        # One query for every known token of this file (email -> token)
+        tokens = existing_tokens(db, list(students))
+        fresh = iter(new_tokens(len(students) - len(tokens)))
+        new_rows = []  # inserted in one executemany once the file is read
+        csv_rows = [["name", "email", "auth_token", "generated_at", "repo_hash"]]
+        for email, name in students.items():
+            if email in tokens:
+                token = tokens[email]
+                log(f"ℹ️  Existing: {name} ({email})")
+            else:
+                token = next(fresh)
+                new_rows.append((email, name, created_at, created_at, token))
+                log(f"✅ Added {name} ({email})")
+
+            csv_rows.append([name, email, token, timestamp, repo_hash])
+
+            if MAIL_ENABLED:
+                mail_queue.append((name, email, token))
+
+        db.executemany(INSERT_USER_SQL, new_rows)
+
+        with open(output_file, "w", newline="", encoding="utf-8", buffering=1 << 20) as out_csv:
+            csv.writer(out_csv).writerows(csv_rows)
 
         log(f"🧾 Tokens written to {output_file.name}")
 
-    db.commit()
-    db.close()
-    log("\n🎉 All students processed successfully.")
-    return True
+    return mail_queue
 
 
 # ---------------------------------------------------------------------
@@ -15,9 +15,10 @@
 # What it does:
 #   1. Reads $REMOTE_IP from the environment.
 #   2. Opens ~/tabbyclassmodels/ee/db.sqlite.
-#   3. Updates the column `network_external_url`
-#      in the table `server_setting` with:
+#   3. Upserts the column `network_external_url`
+#      in the table `server_setting` (row id=1) with:
 #        http://<REMOTE_IP>:8080
+#   4. Closes the shared connection (after PRAGMA optimize).
 # ==========================================================
 
 import sys
@@ -25,43 +26,79 @@ from pathlib import Path
 sys.path.append(str(Path(__file__).resolve().parent.parent))
 import os
 import sqlite3
+from include.sqlite_utils import close_shared_db, shared_db
+
+# Runs after create_students: both steps use the same shared connection.
+DEPENDS_ON = ["30_create_students"]
+
+DB_PATH = Path.home() / "tabbyclassmodels" / "ee" / "db.sqlite"
 
 
 def log(msg: str):
     print(msg, flush=True)
 
 
-def fix_ipaddress():
-    """Update Tabby network_external_url in server_setting table."""
+def upsert_server_settings(conn, settings: dict[str, str]) -> bool:
+    """
+    Write all `settings` columns of server_setting row 1 in one UPSERT.
+
+    Returns False if the row already held these values (nothing written).
+    """
+    known = {row["name"] for row in conn.execute("PRAGMA table_info(server_setting)")}
+    unknown = settings.keys() - known
+    if unknown:
+        raise ValueError(f"unknown server_setting column(s): {', '.join(sorted(unknown))}")
+
+    # Column names are checked above, so they are safe to splice in
+    columns = ", ".join(settings)
+    placeholders = ", ".join("?" * len(settings))
+    updates = ", ".join(f"{col} = excluded.{col}" for col in settings)
+    changed = " OR ".join(f"{col} IS NOT excluded.{col}" for col in settings)
+    cur = conn.execute(
+        f"INSERT INTO server_setting (id, {columns}) VALUES (1, {placeholders}) "
+        f"ON CONFLICT(id) DO UPDATE SET {updates} WHERE {changed}",
+        tuple(settings.values()),
+    )  # autocommit: committed as soon as it runs
+    return cur.rowcount > 0
+
+
+def fix_ipaddress(settings: dict[str, str] | None = None):
+    """Update Tabby network_external_url (plus any extra `settings`) in server_setting."""
     remote_ip = os.getenv("REMOTE_IP")
     if not remote_ip:
         log("❌ REMOTE_IP environment variable not set.")
         return False
 
-    db_path = Path.home() / "tabbyclassmodels" / "ee" / "db.sqlite"
-    if not db_path.exists():
-        log(f"❌ Database not found at {db_path}")
-        return False
-
     new_url = f"http://{remote_ip}:8080"
     log(f"🌍 Setting Tabby network_external_url to {new_url}")
 
     try:
-        conn = sqlite3.connect(db_path)
-        cur = conn.cursor()
-
-        # Update the single-row table
-        cur.execute("UPDATE server_setting SET network_external_url = ? WHERE id = 1", (new_url,))
-        conn.commit()
-        conn.close()
+        # Reuses 30_create_students' connection when run_all runs both steps;
+        # opening it is also the existence check (mode=rw never creates a file).
+        conn = shared_db(DB_PATH)
+    except sqlite3.OperationalError as e:
+        if "unable to open" in str(e):
+            log(f"❌ Database not found at {DB_PATH}")
+        else:
+            log(f"❌ Could not open database: {e}")
+        return False
 
-        log("✅ IP address updated successfully.")
+    try:
+        # Upsert the single-row table; Tabby only creates row 1 on first read
+        if upsert_server_settings(conn, {"network_external_url": new_url, **(settings or {})}):
+            log("✅ IP address updated successfully.")
+        else:
+            log("ℹ️  IP address already up to date — no write needed.")
         return True
 
     except Exception as e:
         log(f"❌ Database update failed: {e}")
         return False
 
+    finally:
+        # Last DB step: release the file before 70_start_tabby opens it
+        close_shared_db(DB_PATH)
+
 
 def main():
     """CLI and run_all entry point."""
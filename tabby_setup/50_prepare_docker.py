@@ -15,33 +15,45 @@
 import sys
 from pathlib import Path
 sys.path.append(str(Path(__file__).resolve().parent.parent))
-import subprocess
+import grp
 import os
-from setup.config import DATA_ROOT, MODEL_ROOT
+import pwd
+import subprocess
+from tabby_setup.config import DATA_ROOT, MODEL_ROOT
 
 def log(msg: str):
     print(msg, flush=True)
 
 
+# Creates the group if needed and adds $1 to it; run as one sudo call.
+DOCKER_GROUP_SCRIPT = (
+    'getent group docker >/dev/null || { groupadd docker && echo "   ➕ Created \'docker\' group."; }; '
+    'adduser "$1" docker >/dev/null; usermod -aG docker "$1"'
+)
+
+
+def in_docker_group(user: str) -> bool:
+    """True if `user` is already a member of the docker group (no subprocess)."""
+    try:
+        gid = grp.getgrnam("docker").gr_gid
+        return gid in os.getgrouplist(user, pwd.getpwnam(user).pw_gid)
+    except KeyError:
+        return False
+
+
 def ensure_docker_group():
     """Ensure docker group exists and user is in it."""
     user = os.getenv("USER", "ubuntu")
     log(f"==> Ensuring docker group membership for {user}")
 
-    # Check or create docker group
-    result = subprocess.run(["getent", "group", "docker"], capture_output=True, text=True)
-    if not result.stdout.strip():
-        subprocess.run(["sudo", "groupadd", "docker"], check=False)
-        log("   ➕ Created 'docker' group.")
-
-    # Check membership
-    group_check = subprocess.run(["id", "-nG", user], capture_output=True, text=True)
-    if "docker" in group_check.stdout:
+    if in_docker_group(user):
         log(f"   ✅ {user} already in 'docker' group.")
-    else:
-        subprocess.run(["sudo", "adduser", user, "docker"], check=False)
-        subprocess.run(["sudo", "usermod", "-aG", "docker", user], check=False)
-        log(f"   ➕ Added {user} to 'docker' group (effective after re-login).")
+        return
+
+    # Group creation + membership in a single sudo invocation; the user is
+    # passed as $1 because sudo resets the environment.
+    subprocess.run(["sudo", "sh", "-c", DOCKER_GROUP_SCRIPT, "sh", user], check=False)
+    log(f"   ➕ Added {user} to 'docker' group (effective after re-login).")
 
 
 def ensure_data_dirs():
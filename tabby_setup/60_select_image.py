@@ -11,12 +11,22 @@
 #
 # Writes the selected image name into:
 #     /tmp/tabby_image.txt
+# A choice made less than IMAGE_CACHE_TTL seconds ago is reused
+# without asking the Docker daemon again.
 # ==========================================================
 
 import sys
 from pathlib import Path
 sys.path.append(str(Path(__file__).resolve().parent.parent))
 import subprocess
+import time
+
+IMAGE_FILE = Path("/tmp/tabby_image.txt")
+IMAGE_CACHE_TTL = 3600  # seconds
+
+# Only talks to the Docker daemon; waits for the AWS/apt bootstrap but
+# may pull while the restores are still downloading.
+DEPENDS_ON = ["00_aws_env"]
 
 def log(msg: str):
     print(msg, flush=True)
@@ -28,6 +38,15 @@ def select_docker_image():
 
     log("==> Selecting Docker image")
 
+    try:
+        if time.time() - IMAGE_FILE.stat().st_mtime < IMAGE_CACHE_TTL:
+            image = IMAGE_FILE.read_text().strip()
+            if image:
+                log(f"   ✅ Reusing recently selected image: {image}")
+                return image
+    except OSError:
+        pass
+
     result = subprocess.run(["sudo", "docker", "image", "inspect", local_image],
                             stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
     if result.returncode == 0:
@@ -38,11 +57,9 @@ def select_docker_image():
         log(f"   ⚙️  Local image not found, pulling {image} ...")
         subprocess.run(["sudo", "docker", "pull", image], check=True)
 
-    tmpfile = "/tmp/tabby_image.txt"
-    with open(tmpfile, "w") as f:
-        f.write(image)
+    IMAGE_FILE.write_text(image)
 
-    log(f"   💾 Saved image name to {tmpfile}")
+    log(f"   💾 Saved image name to {IMAGE_FILE}")
     return image
 
 
@@ -22,7 +22,8 @@ from pathlib import Path
 sys.path.append(str(Path(__file__).resolve().parent.parent))
 import os
 import subprocess
-from setup.config import (
+import time
+from tabby_setup.config import (
     DATA_ROOT,
     MODEL_ROOT,
     PORT,
@@ -76,7 +77,7 @@ def start_container(image: str, container_name: str, jwt_secret: str, remote_ip:
 
 def show_logs(container_name: str):
     log("==> Checking container logs (last 50 lines)")
-    subprocess.run(["sleep", "2"])
+    time.sleep(2)  # give the server a moment to print its startup lines
     subprocess.run(["sudo", "docker", "logs", "--tail", "50", container_name], check=False)
 
 
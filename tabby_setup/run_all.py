@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 # ==========================================================
-# 🧩  run_all.py — Execute All Setup Steps Sequentially
+# 🧩  run_all.py — Execute All Setup Steps
 # ==========================================================
 # Automatically discovers and runs all numbered setup scripts
 # (e.g. 10_restore_db.py, 20_restore_models.py, …).
@@ -13,17 +13,27 @@
 #   - Imports each script as a module.
 #   - Calls its `main()` function directly (no subprocess).
 #   - Prints progress in the form (1/7), (2/7), etc.
-#   - Stops immediately if any step raises an exception
-#     or exits with a nonzero status.
+#   - A script may declare `DEPENDS_ON = [...]` (names of other
+#     steps); steps whose dependencies are done run concurrently.
+#     Scripts without DEPENDS_ON wait for every earlier step.
+#     Set RUN_ALL_SERIAL=1 to force strictly sequential execution.
+#   - Stops as soon as any step raises an exception
+#     or exits with a nonzero status; steps still running are
+#     abandoned and their child processes terminated.
 #
 # Environment:
 #   Must have all required env vars set for the individual
 #   scripts (e.g. AWS credentials, REMOTE_IP, secrets, etc.).
 # ==========================================================
 
-import importlib
-import pkgutil
+import functools
+import importlib.util
+import os
+import re
+import signal
 import sys
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from pathlib import Path
 
 
@@ -31,16 +41,152 @@ def log(msg: str):
     print(msg, flush=True)
 
 
+class LineLockedStdout:
+    """
+    sys.stdout stand-in while steps run concurrently: each thread's output
+    is held until a full line (or an explicit flush, e.g. a progress bar)
+    and then written under one lock, so steps never interleave mid-line.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def write(self, s: str) -> int:
+        buf = getattr(self._local, "buf", "") + s
+        cut = buf.rfind("\n") + 1
+        if cut:
+            with self._lock:
+                self.stream.write(buf[:cut])
+                self.stream.flush()
+        self._local.buf = buf[cut:]
+        return len(s)
+
+    def flush(self):
+        buf, self._local.buf = getattr(self._local, "buf", ""), ""
+        with self._lock:
+            self.stream.write(buf)
+            self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+def terminate_children():
+    """SIGTERM this process's child processes (tar, docker, ollama, ...)."""
+    me = os.getpid()
+    for stat in Path("/proc").glob("[0-9]*/stat"):
+        try:
+            # "pid (comm) state ppid ..." — comm may contain spaces
+            if int(stat.read_text().rsplit(")", 1)[1].split()[1]) == me:
+                os.kill(int(stat.parent.name), signal.SIGTERM)
+        except (OSError, IndexError, ValueError):
+            pass
+
+
+def abort(code):
+    """
+    Exit right away although other steps are still running.
+
+    Worker threads cannot be interrupted and a normal exit joins them
+    (ThreadPoolExecutor shutdown), so stop their child processes and
+    leave via os._exit instead of waiting for e.g. a multi-GB download.
+    """
+    log("🛑 Stopping the steps that are still running.")
+    terminate_children()
+    sys.stdout.flush()
+    os._exit(code if isinstance(code, int) else 1)
+
+
+# Numbered setup scripts like 10_restore_db.py; group 1 is the sort key
+SCRIPT_RE = re.compile(r"(\d+)_\w*\.py")
+
+
+@functools.lru_cache(maxsize=1)
 def discover_scripts():
-    """Return sorted list of setup modules like ['10_restore_db', ...]."""
+    """Return sorted list of (name, path) for setup modules like ('10_restore_db', '/…/10_restore_db.py')."""
     setup_dir = Path(__file__).parent
-    modules = []
-    for module_info in pkgutil.iter_modules([str(setup_dir)]):
-        name = module_info.name
-        # Match numbered prefix files only
-        if name[:2].isdigit() and "_" in name:
-            modules.append(name)
-    return sorted(modules, key=lambda n: int(n.split("_")[0]))
+    hits = []
+    with os.scandir(setup_dir) as entries:
+        for entry in entries:
+            if match := SCRIPT_RE.fullmatch(entry.name):
+                hits.append((int(match.group(1)), entry.name[:-3], entry.path))
+    hits.sort()
+    return [(name, path) for _, name, path in hits]
+
+
+def load_script(package_name: str, name: str, path: str):
+    """Import a setup script straight from its file, without a sys.path search."""
+    # Already loaded by an earlier run_all.main() in this process
+    if (mod := sys.modules.get(f"{package_name}.{name}")) is not None:
+        return mod
+    spec = importlib.util.spec_from_file_location(f"{package_name}.{name}", path)
+    mod = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = mod
+    spec.loader.exec_module(mod)
+    return mod
+
+
+def run_step(label: str, name: str, mod) -> int:
+    """Run one step's main(); return its exit code instead of raising."""
+    log(f"=== {label} Running {name} ===")
+    try:
+        if hasattr(mod, "main"):
+            mod.main()
+        else:
+            log(f"⚠️  Module {name} has no main() function — skipped.")
+    except SystemExit as e:
+        if e.code:
+            log(f"❌ {name} exited with code {e.code}. Stopping.")
+            return e.code
+    except Exception as e:
+        log(f"❌ {name} failed: {e}")
+        return 1
+    return 0
+
+
+def run_concurrently(steps: list):
+    """Run [(name, module), ...] as a DAG of DEPENDS_ON edges; exit on the first failure."""
+    total = len(steps)
+    labels = {name: f"({i}/{total})" for i, (name, _) in enumerate(steps, start=1)}
+    deps = {}
+    earlier = []
+    for name, mod in steps:
+        declared = getattr(mod, "DEPENDS_ON", None)
+        deps[name] = set(earlier) if declared is None else set(declared)
+        earlier.append(name)
+
+    pending = dict(steps)
+    done = set()
+    running = {}
+    sys.stdout = LineLockedStdout(sys.stdout)
+    try:
+        with ThreadPoolExecutor(max_workers=total) as pool:
+            try:
+                while pending or running:
+                    for name in [n for n in pending if deps[n] <= done]:
+                        running[pool.submit(run_step, labels[name], name, pending.pop(name))] = name
+                    if not running:
+                        log(f"❌ Unsatisfiable DEPENDS_ON for: {', '.join(pending)}")
+                        sys.exit(1)
+                    finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        code = future.result()
+                        done.add(running.pop(future))
+                        if not code:
+                            continue
+                        if running:
+                            pool.shutdown(wait=False, cancel_futures=True)
+                            abort(code)
+                        sys.exit(code)
+            except KeyboardInterrupt:
+                # Leaving the with-block would join the running steps
+                log("\n🛑 Aborted by user.")
+                pool.shutdown(wait=False, cancel_futures=True)
+                abort(130)
+    finally:
+        sys.stdout = sys.stdout.stream
 
 
 def main():
@@ -54,23 +200,22 @@ def main():
 
     log(f"🧩 Found {total} setup steps to execute.\n")
 
-    for i, name in enumerate(scripts, start=1):
-        log(f"=== ({i}/{total}) Running {name} ===")
+    steps = []
+    for name, path in scripts:
         try:
-            mod = importlib.import_module(f"setup.{name}")
-            if hasattr(mod, "main"):
-                mod.main()
-            else:
-                log(f"⚠️  Module {name} has no main() function — skipped.")
-        except SystemExit as e:
-            # Propagate nonzero exit codes to stop the chain
-            if e.code != 0:
-                log(f"❌ {name} exited with code {e.code}. Stopping.")
-                sys.exit(e.code)
+            steps.append((name, load_script("setup", name, path)))
         except Exception as e:
-            log(f"❌ {name} failed: {e}")
+            log(f"❌ {name} failed to load: {e}")
             sys.exit(1)
 
+    if os.environ.get("RUN_ALL_SERIAL") == "1":
+        for i, (name, mod) in enumerate(steps, start=1):
+            code = run_step(f"({i}/{total})", name, mod)
+            if code:
+                sys.exit(code)
+    else:
+        run_concurrently(steps)
+
     log("\n🎉 All setup steps completed successfully.")
 
 
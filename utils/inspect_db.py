@@ -28,33 +28,43 @@ if not db_path.exists():
 
 print(f"🔍 Inspecting database: {db_path.resolve()}")
 
-db = sqlite3.connect(db_path)
+# Read-only: no write locks or journal setup needed for inspection
+db = sqlite3.connect(db_path.resolve().as_uri() + "?mode=ro", uri=True)
+db.execute("PRAGMA mmap_size=1073741824;")  # 1 GiB: let the kernel page the file in
+db.execute("PRAGMA cache_size=-262144;")    # 256 MiB page cache
 
-# --- List tables ---
-print("\n=== TABLES ===")
-tables = [t for (t,) in db.execute("SELECT name FROM sqlite_master WHERE type='table';")]
+# The report is collected here and written to stdout in one go
+out = []
+
+# --- List tables (names + CREATE statements in one fetch) ---
+out.append("\n=== TABLES ===")
+schemas = dict(db.execute("SELECT name, sql FROM sqlite_master WHERE type='table';"))
+tables = list(schemas)
 for t in tables:
-    print("-", t)
+    out.append(f"- {t}")
+
+# --- Columns of every table in one statement ---
+columns = {t: [] for t in tables}
+for table, *col in db.execute(
+    "SELECT m.name, p.cid, p.name, p.type, p.\"notnull\", p.dflt_value, p.pk "
+    "FROM sqlite_master m JOIN pragma_table_info(m.name) p "
+    "WHERE m.type='table' ORDER BY m.name, p.cid;"
+):
+    columns[table].append(col)
 
 # --- Show CREATE statements for key tables ---
 def show_schema(table_name: str):
-    rows = db.execute("SELECT sql FROM sqlite_master WHERE name=?;", (table_name,)).fetchall()
-    if not rows:
-        print(f"\n=== SCHEMA ({table_name}) — not found ===")
+    if table_name not in schemas:
+        out.append(f"\n=== SCHEMA ({table_name}) — not found ===")
         return
-    print(f"\n=== SCHEMA ({table_name}) ===")
-    for (sql,) in rows:
-        print(sql)
+    out.append(f"\n=== SCHEMA ({table_name}) ===")
+    out.append(schemas[table_name])
 
 # --- Show columns of a table ---
 def show_columns(table_name: str):
-    try:
-        cols = db.execute(f"PRAGMA table_info({table_name});").fetchall()
-        print(f"\n=== COLUMNS ({table_name}) ===")
-        for cid, name, ctype, notnull, dflt, pk in cols:
-            print(f"{name:20} {ctype:10} {'PRIMARY KEY' if pk else ''}")
-    except sqlite3.OperationalError:
-        print(f"⚠️ Could not inspect columns for {table_name}")
+    out.append(f"\n=== COLUMNS ({table_name}) ===")
+    for cid, name, ctype, notnull, dflt, pk in columns[table_name]:
+        out.append(f"{name:20} {ctype:10} {'PRIMARY KEY' if pk else ''}")
 
 # --- Inspect all tables (short version) ---
 for t in tables:
@@ -62,17 +72,18 @@ for t in tables:
 
 # --- Focused inspection for known Tabby tables ---
 if "server_setting" in tables:
-    cols = [name for _, name, *_ in db.execute("PRAGMA table_info(server_setting);")]
-    print()
+    cols = [name for _, name, *_ in columns["server_setting"]]
+    out.append("")
     if "key" in cols:
-        print("✅ server_setting uses column 'key'")
+        out.append("✅ server_setting uses column 'key'")
     elif "name" in cols:
-        print("✅ server_setting uses column 'name'")
+        out.append("✅ server_setting uses column 'name'")
     else:
-        print("⚠️ server_setting has neither 'key' nor 'name' column")
+        out.append("⚠️ server_setting has neither 'key' nor 'name' column")
 
 if "users" in tables:
-    print("\n✅ 'users' table detected (auth info present)")
+    out.append("\n✅ 'users' table detected (auth info present)")
 
 db.close()
-print("\n🎉 Done. Database structure inspection complete.")
+out.append("\n🎉 Done. Database structure inspection complete.")
+sys.stdout.write("\n".join(out) + "\n")
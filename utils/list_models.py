@@ -1,8 +1,12 @@
 #!/usr/bin/env python3
-import json
 import sys
 from pathlib import Path
 
+try:
+    import orjson as _json  # optional, much faster on multi-MB models.json
+except ImportError:
+    import json as _json
+
 def main():
     if len(sys.argv) < 2:
         print("Usage: python list_models.py <path_to_models.js>")
@@ -13,10 +17,12 @@ def main():
         print(f"Error: file not found → {path}")
         sys.exit(1)
 
-    data = json.loads(path.read_text())
+    data = _json.loads(path.read_bytes())
 
-    print(f"{'Model Name':<28} | {'Template Type':<15} | {'Files / URLs'}")
-    print("-" * 90)
+    rows = [
+        f"{'Model Name':<28} | {'Template Type':<15} | {'Files / URLs'}",
+        "-" * 90,
+    ]
 
     for m in data:
         name = m.get("name", "")
@@ -38,7 +44,9 @@ def main():
         if len(urls) > 2:
             urls_str += f" ... (+{len(urls)-2} more)"
 
-        print(f"{name:<28} | {ttype:<15} | {urls_str}")
+        rows.append(f"{name:<28} | {ttype:<15} | {urls_str}")
+
+    sys.stdout.write("\n".join(rows) + "\n")
 
 if __name__ == "__main__":
     main()